@@ -65,7 +65,9 @@ def extract_tables_and_charts_using_image_ensemble(
     tables_and_charts = []
 
     try:
-        model_interface = yolox_utils.YoloxPageElementsModelInterface()
+        model_interface = yolox_utils.YoloxPageElementsModelInterface(
+            input_dtype=config.yolox_input_dtype, use_gpu=config.yolox_use_gpu
+        )
         yolox_client = create_inference_client(
             config.yolox_endpoints, model_interface, config.auth_token, config.yolox_infer_protocol
         )
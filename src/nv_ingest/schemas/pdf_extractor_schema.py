@@ -4,6 +4,7 @@
 
 
 import logging
+from typing import Literal
 from typing import Optional
 from typing import Tuple
 
@@ -25,6 +26,14 @@ class PDFiumConfigSchema(BaseModel):
         A tuple containing the gRPC and HTTP services for the yolox endpoint.
         Either the gRPC or HTTP service can be empty, but not both.
 
+    yolox_use_gpu : bool, default=False
+        Whether to resize gRPC yolox inputs and post-process its predictions on the GPU. Disabled by default,
+        since every extraction worker process would otherwise create its own CUDA context.
+
+    yolox_input_dtype : str, default="float32"
+        The dtype of the image batches sent to the gRPC yolox endpoint, "float32" or "float16". It must match the
+        input datatype of the deployed model.
+
     Methods
     -------
     validate_endpoints(values)
@@ -45,6 +54,8 @@ class PDFiumConfigSchema(BaseModel):
 
     yolox_endpoints: Tuple[Optional[str], Optional[str]] = (None, None)
     yolox_infer_protocol: str = ""
+    yolox_use_gpu: bool = False
+    yolox_input_dtype: Literal["float32", "float16"] = "float32"
 
     nim_batch_size: int = 4
     workers_per_progress_engine: int = 5
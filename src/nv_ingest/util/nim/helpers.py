@@ -15,6 +15,7 @@ import cv2
 import numpy as np
 import requests
 import tritonclient.grpc as grpcclient
+from tritonclient.utils import np_to_triton_dtype
 from packaging import version as pkgversion
 
 from nv_ingest.util.image_processing.transforms import normalize_image
@@ -304,7 +305,8 @@ class NimClient:
             The output of the model as a numpy array.
         """
 
-        input_tensors = [grpcclient.InferInput("input", formatted_input.shape, datatype="FP32")]
+        datatype = np_to_triton_dtype(formatted_input.dtype)
+        input_tensors = [grpcclient.InferInput("input", formatted_input.shape, datatype=datatype)]
         input_tensors[0].set_data_from_numpy(formatted_input)
 
         outputs = [grpcclient.InferRequestedOutput("output")]
@@ -4,9 +4,11 @@
 
 
 import base64
-import io
 import logging
+import os
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 from typing import Dict
 from typing import List
@@ -16,7 +18,7 @@ import cv2
 import numpy as np
 import torch
 import torchvision
-from PIL import Image
+from torchvision.transforms.v2 import functional as TF
 
 from nv_ingest.util.image_processing.transforms import scale_image_to_encoding_size
 from nv_ingest.util.nim.helpers import ModelInterface
@@ -37,6 +39,32 @@ YOLOX_IMAGE_PREPROC_HEIGHT = 1024
 YOLOX_IMAGE_PREPROC_WIDTH = 1024
 
 
+# Thread pool for encoding HTTP images, created lazily so that every (forked) process gets its own
+_encode_executor: Optional[ThreadPoolExecutor] = None
+_encode_executor_lock = threading.Lock()
+
+
+def _get_encode_executor() -> ThreadPoolExecutor:
+    global _encode_executor
+
+    with _encode_executor_lock:
+        if _encode_executor is None:
+            _encode_executor = ThreadPoolExecutor(max_workers=YOLOX_MAX_BATCH_SIZE, thread_name_prefix="yolox-encode")
+        return _encode_executor
+
+
+def _reset_encode_executor() -> None:
+    # Worker threads do not survive a fork, so the child must not reuse the parent's executor (or its lock)
+    global _encode_executor, _encode_executor_lock
+
+    _encode_executor = None
+    _encode_executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_encode_executor)
+
+
 def chunkify(lst, chunk_size):
     for i in range(0, len(lst), chunk_size):
         yield lst[i : i + chunk_size]
@@ -48,6 +76,34 @@ class YoloxPageElementsModelInterface(ModelInterface):
     An interface for handling inference with a Yolox object detection model, supporting both gRPC and HTTP protocols.
     """
 
+    def __init__(self, input_dtype: np.dtype = np.float32, use_gpu: bool = False) -> None:
+        """
+        Initialize the Yolox model interface.
+
+        Parameters
+        ----------
+        input_dtype : np.dtype, optional
+            The dtype of the image batches sent over gRPC (default is np.float32). It must match the input datatype
+            of the deployed model; np.float16 halves the payload size for models that accept FP16 input.
+        use_gpu : bool, optional
+            Whether to resize gRPC inputs and post-process gRPC predictions on the GPU when one is available
+            (default is False).
+        """
+        self.input_dtype = np.dtype(input_dtype)
+        self.use_gpu = use_gpu and torch.cuda.is_available()
+        self._input_buffer: Optional[np.ndarray] = None
+
+    def _get_input_buffer(self, shape) -> np.ndarray:
+        """
+        Returns a view of shape `shape` into the persistent gRPC input buffer, reallocating the buffer only when
+        it is too small for the requested batch or its image dimensions change.
+        """
+        buffer = self._input_buffer
+        if buffer is None or buffer.shape[0] < shape[0] or buffer.shape[1:] != tuple(shape[1:]):
+            buffer = self._input_buffer = np.empty(shape, dtype=self.input_dtype)
+
+        return buffer[: shape[0]]
+
     def name(
         self,
     ) -> str:
@@ -82,8 +138,9 @@ class YoloxPageElementsModelInterface(ModelInterface):
         if not all(isinstance(x, np.ndarray) for x in data["images"]):
             raise ValueError("All elements in the 'images' list must be numpy.ndarray objects.")
 
+        # Store the original (height, width) of every image as a single (batch, 2) array
         original_images = data["images"]
-        data["original_image_shapes"] = [image.shape for image in original_images]
+        data["original_image_shapes"] = np.array([image.shape[:2] for image in original_images], dtype=np.int64)
 
         return data
 
@@ -104,48 +161,56 @@ class YoloxPageElementsModelInterface(ModelInterface):
         Returns
         -------
         List[Any]
-            A list of batches, each formatted according to the protocol.
+            A list of batches, each formatted according to the protocol. gRPC batches are views into a buffer
+            owned by this interface and are overwritten by the next call to `format_input`.
         """
         if protocol == "grpc":
             logger.debug("Formatting input for gRPC Yolox model")
 
-            # Our yolox-page-elements model (gRPC) expects images to be resized to 1024x1024
-            resized_images = [
-                resize_image(image, (YOLOX_IMAGE_PREPROC_WIDTH, YOLOX_IMAGE_PREPROC_HEIGHT)) for image in data["images"]
-            ]
+            images = data["images"]
+            if not images:
+                return []
+
+            # Our yolox-page-elements model (gRPC) expects images to be resized to 1024x1024. All batches are
+            # written into consecutive slices of a single buffer that is reused across calls.
+            input_buffer = self._get_input_buffer(
+                (len(images), images[0].shape[2], YOLOX_IMAGE_PREPROC_HEIGHT, YOLOX_IMAGE_PREPROC_WIDTH)
+            )
 
             # Create a list of smaller batches (chunkify)
             batches = []
-            for chunk in chunkify(resized_images, max_batch_size):
-                # Reorder axes to match model input (batch, channels, height, width)
-                input_array = np.einsum("bijk->bkij", chunk).astype(np.float32)
+            start = 0
+            for chunk in chunkify(images, max_batch_size):
+                input_array = input_buffer[start : start + len(chunk)]
+                start += len(chunk)
+
+                if self.use_gpu:
+                    # Resize and pad the chunk as a single batch on the GPU
+                    resize_images_torch(
+                        chunk,
+                        (YOLOX_IMAGE_PREPROC_WIDTH, YOLOX_IMAGE_PREPROC_HEIGHT),
+                        device="cuda",
+                        out=input_array,
+                    )
+                else:
+                    for k, image in enumerate(chunk):
+                        resized_image = resize_image(image, (YOLOX_IMAGE_PREPROC_WIDTH, YOLOX_IMAGE_PREPROC_HEIGHT))
+                        # Reorder axes to match model input (channels, height, width), casting to the input dtype
+                        # in the same copy instead of materializing a transposed array and then converting it
+                        np.copyto(input_array[k], resized_image.transpose(2, 0, 1))
+
                 batches.append(input_array)
 
             return batches
 
         elif protocol == "http":
             logger.debug("Formatting input for HTTP Yolox model")
-            content_list = []
-            for image in data["images"]:
-                # Convert numpy array to PIL Image
-                image_pil = Image.fromarray((image * 255).astype(np.uint8))
-                original_size = image_pil.size  # e.g., (1024, 1024)
-
-                # Save image to buffer
-                buffered = io.BytesIO()
-                image_pil.save(buffered, format="PNG")
-                image_b64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-
-                # Scale the image if necessary
-                scaled_image_b64, new_size = scale_image_to_encoding_size(
-                    image_b64, max_base64_size=YOLOX_NIM_MAX_IMAGE_SIZE
-                )
-
-                if new_size != original_size:
-                    logger.warning(f"Image was scaled from {original_size} to {new_size}.")
-
-                # Add to content_list
-                content_list.append({"type": "image_url", "url": f"data:image/png;base64,{scaled_image_b64}"})
+            images = data["images"]
+            if len(images) > 1:
+                # PNG encoding releases the GIL, so images are encoded in parallel
+                content_list = list(_get_encode_executor().map(_encode_image_content, images))
+            else:
+                content_list = [_encode_image_content(image) for image in images]
 
             # Now split content_list into batches of up to max_batch_size
             batches = []
@@ -240,7 +305,14 @@ class YoloxPageElementsModelInterface(ModelInterface):
 
         elif protocol == "grpc":
             # For grpc, apply the same NIM postprocessing.
-            pred = postprocess_model_prediction(output, num_classes, conf_thresh, iou_thresh, class_agnostic=True)
+            pred = postprocess_model_prediction(
+                output,
+                num_classes,
+                conf_thresh,
+                iou_thresh,
+                class_agnostic=True,
+                device="cuda" if self.use_gpu else "cpu",
+            )
             results = postprocess_results(pred, original_image_shapes, min_score=min_score)
 
         # Table/chart expansion is "business logic" specific to nv-ingest
@@ -263,61 +335,96 @@ class YoloxPageElementsModelInterface(ModelInterface):
         return inference_results
 
 
-def postprocess_model_prediction(prediction, num_classes, conf_thre=0.7, nms_thre=0.45, class_agnostic=False):
-    # Convert numpy array to torch tensor
-    prediction = torch.from_numpy(prediction.copy())
+def _encode_image_content(image):
+    """
+    Encodes a single image as a base64 PNG `image_url` content entry for the HTTP Yolox endpoint,
+    scaling it down if it exceeds YOLOX_NIM_MAX_IMAGE_SIZE.
+    """
+    original_size = (image.shape[1], image.shape[0])  # (width, height), e.g., (1024, 1024)
 
-    # Compute box corners
-    box_corner = prediction.new(prediction.shape)
-    box_corner[:, :, 0] = prediction[:, :, 0] - prediction[:, :, 2] / 2
-    box_corner[:, :, 1] = prediction[:, :, 1] - prediction[:, :, 3] / 2
-    box_corner[:, :, 2] = prediction[:, :, 0] + prediction[:, :, 2] / 2
-    box_corner[:, :, 3] = prediction[:, :, 1] + prediction[:, :, 3] / 2
-    prediction[:, :, :4] = box_corner[:, :, :4]
+    # Encode straight to PNG bytes; OpenCV expects BGR channel order. Level 6 (zlib's default, which PIL uses)
+    # with the filtered strategy compresses about as well as PIL did, so pages are not pushed over the size limit
+    # and downscaled
+    image_bgr = cv2.cvtColor((image * 255).astype(np.uint8), cv2.COLOR_RGB2BGR)
+    png_params = [cv2.IMWRITE_PNG_COMPRESSION, 6, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_FILTERED]
+    success, buffer = cv2.imencode(".png", image_bgr, png_params)
+    if not success:
+        raise ValueError(f"Failed to encode image of shape {image.shape} as PNG.")
+    image_b64 = base64.b64encode(buffer).decode("ascii")
 
-    output = [None for _ in range(len(prediction))]
+    # Scale the image if necessary; images already within the limit skip the decode/re-encode round trip
+    if len(image_b64) > YOLOX_NIM_MAX_IMAGE_SIZE:
+        image_b64, new_size = scale_image_to_encoding_size(image_b64, max_base64_size=YOLOX_NIM_MAX_IMAGE_SIZE)
 
-    for i, image_pred in enumerate(prediction):
-        # If no detections, continue to the next image
-        if not image_pred.size(0):
-            continue
+        if new_size != original_size:
+            logger.warning(f"Image was scaled from {original_size} to {new_size}.")
 
-        # Ensure image_pred is 2D
-        if image_pred.ndim == 1:
-            image_pred = image_pred.unsqueeze(0)
+    return {"type": "image_url", "url": f"data:image/png;base64,{image_b64}"}
 
-        # Get score and class with highest confidence
-        class_conf, class_pred = torch.max(image_pred[:, 5 : 5 + num_classes], 1, keepdim=True)
 
-        # Confidence mask
-        squeezed_conf = class_conf.squeeze(dim=1)
-        conf_mask = image_pred[:, 4] * squeezed_conf >= conf_thre
+def postprocess_model_prediction(
+    prediction, num_classes, conf_thre=0.7, nms_thre=0.45, class_agnostic=False, device="cpu"
+):
+    """
+    Applies the confidence threshold and NMS to raw Yolox predictions of shape (batch, boxes, 5 + num_classes).
 
-        # Apply confidence mask
-        detections = torch.cat((image_pred[:, :5], class_conf, class_pred.float()), 1)
-        detections = detections[conf_mask]
+    `prediction` may be a numpy array or a torch tensor. Numpy input is processed on `device`: on the CPU it is
+    shared without copying (unless it is read-only), otherwise it is copied to the device. Tensors are processed
+    on their own device. The input is not modified.
+    Returns a list with, per image, a tensor of [x1, y1, x2, y2, obj_conf, class_conf, class_pred] rows or None.
+    """
+    if isinstance(prediction, np.ndarray):
+        if device != "cpu":
+            prediction = torch.tensor(prediction, device=device)
+        elif prediction.flags.writeable:
+            prediction = torch.from_numpy(prediction)
+        else:
+            # torch warns when sharing memory with read-only arrays (e.g. gRPC response buffers)
+            prediction = torch.from_numpy(prediction.copy())
 
-        if not detections.size(0):
-            continue
+    # Convert (cx, cy, w, h) to box corners (x1, y1, x2, y2)
+    center = prediction[..., :2]
+    half_size = prediction[..., 2:4] * 0.5
+    corners = torch.cat((center - half_size, center + half_size), -1)
 
-        # Apply Non-Maximum Suppression (NMS)
-        if class_agnostic:
-            nms_out_index = torchvision.ops.nms(
-                detections[:, :4],
-                detections[:, 4] * detections[:, 5],
-                nms_thre,
-            )
-        else:
-            nms_out_index = torchvision.ops.batched_nms(
-                detections[:, :4],
-                detections[:, 4] * detections[:, 5],
-                detections[:, 6],
-                nms_thre,
-            )
-        detections = detections[nms_out_index]
+    # Get score and class with highest confidence for the whole batch at once
+    class_conf, class_pred = torch.max(prediction[..., 5 : 5 + num_classes], -1, keepdim=True)
+
+    # Confidence mask, shape (batch, boxes)
+    conf_mask = prediction[..., 4] * class_conf.squeeze(-1) >= conf_thre
+
+    # [x1, y1, x2, y2, obj_conf, class_conf, class_pred]
+    all_detections = torch.cat((corners, prediction[..., 4:5], class_conf, class_pred.float()), -1)
+
+    # Gather the detections that pass the confidence mask across the whole batch
+    batch_idxs, box_idxs = torch.nonzero(conf_mask, as_tuple=True)
+    detections = all_detections[batch_idxs, box_idxs]
+
+    output = [None for _ in range(len(prediction))]
+
+    if not detections.size(0):
+        return output
+
+    # Apply Non-Maximum Suppression (NMS) once for the whole batch, grouping by image (and class)
+    if class_agnostic:
+        group_idxs = batch_idxs
+    else:
+        group_idxs = batch_idxs * num_classes + detections[:, 6].long()
 
-        # Append detections to output
-        output[i] = detections
+    nms_out_index = torchvision.ops.batched_nms(
+        detections[:, :4],
+        detections[:, 4] * detections[:, 5],
+        group_idxs,
+        nms_thre,
+    )
+
+    # Split the kept detections back per image, preserving their descending score order
+    nms_out_index = nms_out_index[torch.argsort(batch_idxs[nms_out_index], stable=True)]
+    counts = torch.bincount(batch_idxs[nms_out_index], minlength=len(prediction))
+
+    for i, image_detections in enumerate(torch.split(detections[nms_out_index], counts.tolist())):
+        if image_detections.size(0):
+            output[i] = image_detections
 
     return output
 
@@ -337,7 +444,16 @@ def postprocess_results(results, original_image_shapes, min_score=0.0):
     class_labels = ["table", "chart", "title"]
     out = []
 
-    for original_image_shape, result in zip(original_image_shapes, results):
+    # (height, width) of every image; full (height, width, channels) shapes are accepted as well
+    image_sizes = np.array([shape[:2] for shape in original_image_shapes], dtype=np.float64).reshape(-1, 2)
+    heights, widths = image_sizes[:, 0], image_sizes[:, 1]
+
+    # ratio is used when image was padded
+    ratios = np.minimum(YOLOX_IMAGE_PREPROC_HEIGHT / heights, YOLOX_IMAGE_PREPROC_WIDTH / widths)
+    # (width, height, width, height) * ratio per image, to undo the resize and normalize in a single pass
+    scales = ratios.astype(np.float32)[:, None] * np.column_stack((widths, heights, widths, heights)).astype(np.float32)
+
+    for original_image_shape, scale, result in zip(original_image_shapes, scales, results):
         annotation_dict = {label: [] for label in class_labels}
 
         if result is None:
@@ -345,29 +461,27 @@ def postprocess_results(results, original_image_shapes, min_score=0.0):
             continue
 
         try:
-            result = result.cpu().numpy()
+            # Filter and normalize on the result's device so only the kept rows are copied to the host
             scores = result[:, 4] * result[:, 5]
-            result = result[scores > min_score]
-
-            # ratio is used when image was padded
-            ratio = min(
-                YOLOX_IMAGE_PREPROC_WIDTH / original_image_shape[0],
-                YOLOX_IMAGE_PREPROC_HEIGHT / original_image_shape[1],
-            )
-            bboxes = result[:, :4] / ratio
+            keep = scores > min_score
+            result, scores = result[keep], scores[keep]
 
-            bboxes[:, [0, 2]] /= original_image_shape[1]
-            bboxes[:, [1, 3]] /= original_image_shape[0]
-            bboxes = np.clip(bboxes, 0.0, 1.0)
+            bboxes = torch.clip(result[:, :4] / torch.as_tensor(scale, device=result.device), 0.0, 1.0)
 
-            labels = result[:, 6]
-            scores = scores[scores > min_score]
+            # [x1, y1, x2, y2, score, label]
+            detections = torch.cat((bboxes, scores[:, None], result[:, 6:7]), 1).cpu().numpy()
+            labels = detections[:, 5].astype(int)
         except Exception as e:
-            raise ValueError(f"Error in postprocessing {result.shape} and {original_image_shape}: {e}")
+            raise ValueError(f"Error in postprocessing {result.shape} and {tuple(original_image_shape)}: {e}")
+
+        rows = np.round(detections[:, :5].astype(np.float64), 4)
 
-        for box, score, label in zip(bboxes, scores, labels):
-            class_name = class_labels[int(label)]
-            annotation_dict[class_name].append([round(float(x), 4) for x in np.concatenate((box, [score]))])
+        # Group the rows by class with a single stable sort, then convert each class slice at once
+        order = np.argsort(labels, kind="stable")
+        rows = rows[order]
+        bounds = np.searchsorted(labels[order], np.arange(len(class_labels) + 1))
+        for label, class_name in enumerate(class_labels):
+            annotation_dict[class_name] = rows[bounds[label] : bounds[label + 1]].tolist()
 
         out.append(annotation_dict)
 
@@ -375,23 +489,55 @@ def postprocess_results(results, original_image_shapes, min_score=0.0):
 
 
 def resize_image(image, target_img_size):
-    w, h, _ = np.array(image).shape
+    """
+    Resizes an image to fit within `target_img_size` (width, height), preserving aspect ratio, and pads the
+    bottom/right with the value 114. The padded output is allocated once and the resized image is written
+    directly into its top-left corner.
+    """
+    if target_img_size is None:
+        return image
+
+    height, width, channels = image.shape
+    target_width, target_height = target_img_size
+
+    r = min(target_height / height, target_width / width)
+    new_height, new_width = int(height * r), int(width * r)
+
+    padded = np.full((target_height, target_width, channels), 114, dtype=np.uint8)
+    if image.dtype == np.uint8:
+        cv2.resize(image, (new_width, new_height), dst=padded[:new_height, :new_width], interpolation=cv2.INTER_LINEAR)
+    else:
+        padded[:new_height, :new_width] = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    return padded
+
 
-    if target_img_size is not None:  # Resize + Pad
-        r = min(target_img_size[0] / w, target_img_size[1] / h)
-        image = cv2.resize(
-            image,
-            (int(h * r), int(w * r)),
-            interpolation=cv2.INTER_LINEAR,
-        ).astype(np.uint8)
-        image = np.pad(
-            image,
-            ((0, target_img_size[0] - image.shape[0]), (0, target_img_size[1] - image.shape[1]), (0, 0)),
-            mode="constant",
-            constant_values=114,
-        )
+def resize_images_torch(images, target_img_size, device="cuda", dtype=np.float32, out=None):
+    """
+    Batched counterpart of `resize_image` that runs on `device` with torchvision.
+
+    Images are uploaded as uint8, resized with bilinear interpolation (no antialiasing, to match the
+    cv2.INTER_LINEAR path), and written into a single padded (batch, channels, height, width) uint8 tensor.
+    Only the uint8 batch is copied back to the host, where it is converted to the `dtype` array expected by
+    the model, or written into `out` (whose dtype takes precedence) when it is given.
+    """
+    target_width, target_height = target_img_size
+    channels = images[0].shape[2]
 
-    return image
+    batch = torch.full((len(images), channels, target_height, target_width), 114, dtype=torch.uint8, device=device)
+    for k, image in enumerate(images):
+        height, width = image.shape[:2]
+        r = min(target_height / height, target_width / width)
+        new_height, new_width = int(height * r), int(width * r)
+
+        tensor = torch.from_numpy(np.ascontiguousarray(image)).to(device, non_blocking=True).permute(2, 0, 1)
+        batch[k, :, :new_height, :new_width] = TF.resize(tensor, [new_height, new_width], antialias=False)
+
+    if out is None:
+        return batch.cpu().numpy().astype(dtype)
+
+    np.copyto(out, batch.cpu().numpy())
+    return out
 
 
 def expand_table_bboxes(annotation_dict, labels=None):
@@ -413,14 +559,17 @@ def expand_table_bboxes(annotation_dict, labels=None):
     new_annotation_dict = {label: [] for label in labels}
 
     for label, bboxes in annotation_dict.items():
-        for bbox_and_score in bboxes:
-            bbox, score = bbox_and_score[:4], bbox_and_score[4]
+        if not len(bboxes):
+            continue
+
+        # [x1, y1, x2, y2, score] rows
+        bboxes = np.array(bboxes, dtype=np.float64)[:, :5]
 
-            if label == "table":
-                height = bbox[3] - bbox[1]
-                bbox[1] = max(0.0, min(1.0, bbox[1] - height * 0.2))
+        if label == "table":
+            height = bboxes[:, 3] - bboxes[:, 1]
+            bboxes[:, 1] = np.clip(bboxes[:, 1] - height * 0.2, 0.0, 1.0)
 
-            new_annotation_dict[label].append([round(float(x), 4) for x in bbox + [score]])
+        new_annotation_dict[label] = np.round(bboxes, 4).tolist()
 
     return new_annotation_dict
 
@@ -468,15 +617,9 @@ def expand_chart_bboxes(annotation_dict, labels=None):
     chart_confidences = confidences_wbf[labels_wbf == 1]
     title_bboxes = pred_wbf[labels_wbf == 2]
 
-    found_title_idxs, no_found_title_idxs = [], []
-    for i in range(len(chart_bboxes)):
-        match = match_with_title(chart_bboxes[i], title_bboxes, iou_th=0.01)
-        if match is not None:
-            chart_bboxes[i] = match[0]
-            title_bboxes = match[1]
-            found_title_idxs.append(i)
-        else:
-            no_found_title_idxs.append(i)
+    chart_bboxes, found_title = match_charts_with_titles(chart_bboxes, title_bboxes, iou_th=0.01)
+    found_title_idxs = np.flatnonzero(found_title)
+    no_found_title_idxs = np.flatnonzero(~found_title)
 
     chart_bboxes[found_title_idxs] = expand_boxes(chart_bboxes[found_title_idxs], r_x=1.05, r_y=1.1)
     chart_bboxes[no_found_title_idxs] = expand_boxes(chart_bboxes[no_found_title_idxs], r_x=1.1, r_y=1.25)
@@ -540,25 +683,17 @@ def weighted_boxes_fusion(
     overall_boxes = []
     for label in filtered_boxes:
         boxes = filtered_boxes[label]
-        np.empty((0, 8))
 
-        clusters = []
+        # Clusterize boxes: link each box to its best matching other box, then merge the connected boxes
+        ious = bb_iou_matrix(boxes[:, 4:], boxes[:, 4:])
+        np.fill_diagonal(ious, -1)
+        best_idxs = np.argmax(ious, axis=1)
+        matched = ious[np.arange(len(boxes)), best_idxs] > iou_thr
 
-        # Clusterize boxes
-        for j in range(len(boxes)):
-            ids = [i for i in range(len(boxes)) if i != j]
-            index, best_iou = find_matching_box_fast(boxes[ids], boxes[j], iou_thr)
+        cluster_ids = union_find_clusters(len(boxes), np.flatnonzero(matched), best_idxs[matched])
 
-            if index != -1:
-                index = ids[index]
-                cluster_idx = [clust_idx for clust_idx, clust in enumerate(clusters) if (j in clust or index in clust)]
-                if len(cluster_idx):
-                    cluster_idx = cluster_idx[0]
-                    clusters[cluster_idx] = list(set(clusters[cluster_idx] + [index, j]))
-                else:
-                    clusters.append([index, j])
-            else:
-                clusters.append([j])
+        order = np.argsort(cluster_ids, kind="stable")
+        clusters = np.split(order, np.flatnonzero(np.diff(cluster_ids[order])) + 1)
 
         for j, c in enumerate(clusters):
             if merge_type == "weighted":
@@ -580,6 +715,37 @@ def weighted_boxes_fusion(
     return boxes, scores, labels
 
 
+def union_find_clusters(num_nodes, edges_a, edges_b):
+    """
+    Groups nodes into connected components with a disjoint set union.
+
+    Args:
+        num_nodes (int): Number of nodes.
+        edges_a (np array[m]): First node of each edge.
+        edges_b (np array[m]): Second node of each edge.
+
+    Returns:
+        np array[num_nodes]: Root of the component of each node, i.e. its smallest node index.
+    """
+    parent = list(range(num_nodes))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]  # Path halving
+            x = parent[x]
+        return x
+
+    for a, b in zip(edges_a.tolist(), edges_b.tolist()):
+        root_a, root_b = find(a), find(b)
+        # Attach to the smaller root so that components are ordered by their first node
+        if root_a < root_b:
+            parent[root_b] = root_a
+        elif root_b < root_a:
+            parent[root_a] = root_b
+
+    return np.array([find(x) for x in range(num_nodes)], dtype=np.int64)
+
+
 def prefilter_boxes(boxes, scores, labels, weights, thr, class_agnostic=False):
     """
     Reformats and filters boxes.
@@ -616,107 +782,67 @@ def prefilter_boxes(boxes, scores, labels, weights, thr, class_agnostic=False):
             )
             exit()
 
-        for j in range(len(boxes[t])):
-            score = scores[t][j]
-            if score < thr:
-                continue
-            label = int(labels[t][j])
-            box_part = boxes[t][j]
-            x1 = float(box_part[0])
-            y1 = float(box_part[1])
-            x2 = float(box_part[2])
-            y2 = float(box_part[3])
-
-            # Box data checks
-            if x2 < x1:
-                warnings.warn("X2 < X1 value in box. Swap them.")
-                x1, x2 = x2, x1
-            if y2 < y1:
-                warnings.warn("Y2 < Y1 value in box. Swap them.")
-                y1, y2 = y2, y1
-            if x1 < 0:
-                warnings.warn("X1 < 0 in box. Set it to 0.")
-                x1 = 0
-            if x1 > 1:
-                warnings.warn("X1 > 1 in box. Set it to 1. Check that you normalize boxes in [0, 1] range.")
-                x1 = 1
-            if x2 < 0:
-                warnings.warn("X2 < 0 in box. Set it to 0.")
-                x2 = 0
-            if x2 > 1:
-                warnings.warn("X2 > 1 in box. Set it to 1. Check that you normalize boxes in [0, 1] range.")
-                x2 = 1
-            if y1 < 0:
-                warnings.warn("Y1 < 0 in box. Set it to 0.")
-                y1 = 0
-            if y1 > 1:
-                warnings.warn("Y1 > 1 in box. Set it to 1. Check that you normalize boxes in [0, 1] range.")
-                y1 = 1
-            if y2 < 0:
-                warnings.warn("Y2 < 0 in box. Set it to 0.")
-                y2 = 0
-            if y2 > 1:
-                warnings.warn("Y2 > 1 in box. Set it to 1. Check that you normalize boxes in [0, 1] range.")
-                y2 = 1
-            if (x2 - x1) * (y2 - y1) == 0.0:
-                warnings.warn("Zero area box skipped: {}.".format(box_part))
-                continue
-
-            # [label, score, weight, model index, x1, y1, x2, y2]
-            b = [int(label), float(score) * weights[t], weights[t], t, x1, y1, x2, y2]
+    # Flatten the boxes of all models into single arrays, keeping track of the model index of each box
+    model_idxs = np.repeat(np.arange(len(boxes)), [len(boxes_t) for boxes_t in boxes])
+    if len(model_idxs) == 0:
+        return new_boxes
+
+    all_boxes = np.concatenate([np.asarray(boxes_t, dtype=np.float64)[:, :4] for boxes_t in boxes if len(boxes_t)])
+    all_scores = np.concatenate([np.asarray(scores_t, dtype=np.float64) for scores_t in scores if len(scores_t)])
+    all_labels = np.concatenate([np.asarray(labels_t, dtype=np.float64) for labels_t in labels if len(labels_t)])
+    all_labels = all_labels.astype(int)
+
+    keep = ~(all_scores < thr)
+    all_boxes, all_scores, all_labels, model_idxs = (
+        all_boxes[keep],
+        all_scores[keep],
+        all_labels[keep],
+        model_idxs[keep],
+    )
 
-            label_k = "*" if class_agnostic else label
-            if label_k not in new_boxes:
-                new_boxes[label_k] = []
-            new_boxes[label_k].append(b)
+    # Box data checks
+    if (all_boxes[:, 2] < all_boxes[:, 0]).any():
+        warnings.warn("X2 < X1 value in box. Swap them.")
+    if (all_boxes[:, 3] < all_boxes[:, 1]).any():
+        warnings.warn("Y2 < Y1 value in box. Swap them.")
+    all_boxes[:, [0, 2]] = np.sort(all_boxes[:, [0, 2]], axis=1)
+    all_boxes[:, [1, 3]] = np.sort(all_boxes[:, [1, 3]], axis=1)
+
+    for k, coord in enumerate(["X1", "Y1", "X2", "Y2"]):
+        if (all_boxes[:, k] < 0).any():
+            warnings.warn(f"{coord} < 0 in box. Set it to 0.")
+        if (all_boxes[:, k] > 1).any():
+            warnings.warn(f"{coord} > 1 in box. Set it to 1. Check that you normalize boxes in [0, 1] range.")
+    all_boxes = np.clip(all_boxes, 0, 1)
+
+    zero_area = (all_boxes[:, 2] - all_boxes[:, 0]) * (all_boxes[:, 3] - all_boxes[:, 1]) == 0.0
+    if zero_area.any():
+        warnings.warn("Zero area box skipped: {}.".format(all_boxes[zero_area]))
+
+    # [label, score, weight, model index, x1, y1, x2, y2]
+    model_weights = np.asarray(weights, dtype=np.float64)[model_idxs]
+    all_boxes = np.column_stack(
+        [all_labels, all_scores * model_weights, model_weights, model_idxs, all_boxes],
+    )[~zero_area]
+    all_labels = all_labels[~zero_area]
+
+    if class_agnostic:
+        if len(all_boxes):
+            new_boxes["*"] = all_boxes
+    else:
+        # Keep the labels in order of first appearance
+        unique_labels, first_idxs = np.unique(all_labels, return_index=True)
+        for label in unique_labels[np.argsort(first_idxs)]:
+            new_boxes[int(label)] = all_boxes[all_labels == label]
 
-    # Sort each list in dict by score and transform it to numpy array
+    # Sort each array in dict by score
     for k in new_boxes:
-        current_boxes = np.array(new_boxes[k])
+        current_boxes = new_boxes[k]
         new_boxes[k] = current_boxes[current_boxes[:, 1].argsort()[::-1]]
 
     return new_boxes
 
 
-def find_matching_box_fast(boxes_list, new_box, match_iou):
-    """
-    Reimplementation of find_matching_box with numpy instead of loops. Gives significant speed up for larger arrays
-    (~100x). This was previously the bottleneck since the function is called for every entry in the array.
-    """
-
-    def bb_iou_array(boxes, new_box):
-        # bb interesection over union
-        xA = np.maximum(boxes[:, 0], new_box[0])
-        yA = np.maximum(boxes[:, 1], new_box[1])
-        xB = np.minimum(boxes[:, 2], new_box[2])
-        yB = np.minimum(boxes[:, 3], new_box[3])
-
-        interArea = np.maximum(xB - xA, 0) * np.maximum(yB - yA, 0)
-
-        # compute the area of both the prediction and ground-truth rectangles
-        boxAArea = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
-        boxBArea = (new_box[2] - new_box[0]) * (new_box[3] - new_box[1])
-
-        iou = interArea / (boxAArea + boxBArea - interArea)
-
-        return iou
-
-    if boxes_list.shape[0] == 0:
-        return -1, match_iou
-
-    ious = bb_iou_array(boxes_list[:, 4:], new_box[4:])
-    # ious[boxes[:, 0] != new_box[0]] = -1
-
-    best_idx = np.argmax(ious)
-    best_iou = ious[best_idx]
-
-    if best_iou <= match_iou:
-        best_iou = match_iou
-        best_idx = -1
-
-    return best_idx, best_iou
-
-
 def get_biggest_box(boxes, conf_type="avg"):
     """
     Merges boxes by using the biggest box.
@@ -729,22 +855,15 @@ def get_biggest_box(boxes, conf_type="avg"):
         np array [8]: Merged box.
     """
     box = np.zeros(8, dtype=np.float32)
-    box[4:] = boxes[0][4:]
-    conf_list = []
-    w = 0
-    for b in boxes:
-        box[4] = min(box[4], b[4])
-        box[5] = min(box[5], b[5])
-        box[6] = max(box[6], b[6])
-        box[7] = max(box[7], b[7])
-        conf_list.append(b[1])
-        w += b[2]
-
-    box[0] = merge_labels(np.array([b[0] for b in boxes]), np.array([b[1] for b in boxes]))
-    #     print(box[0], np.array([b[0] for b in boxes]))
-
-    box[1] = np.max(conf_list) if conf_type == "max" else np.mean(conf_list)
-    box[2] = w
+    confs = boxes[:, 1]
+
+    box[4:6] = boxes[:, 4:6].min(axis=0)
+    box[6:8] = boxes[:, 6:8].max(axis=0)
+
+    box[0] = merge_labels(boxes[:, 0], confs)
+
+    box[1] = confs.max() if conf_type == "max" else confs.mean()
+    box[2] = boxes[:, 2].sum()
     box[3] = -1  # model index field is retained for consistency but is not used.
     return box
 
@@ -770,63 +889,70 @@ def merge_labels(labels, confs):
         return labels[np.argmax(confs)]
 
 
-def match_with_title(chart_bbox, title_bboxes, iou_th=0.01):
+def match_charts_with_titles(chart_bboxes, title_bboxes, iou_th=0.01):
+    """
+    Greedily merges each chart bounding box with the title bounding boxes that belong to it.
+
+    Charts are processed in order, and each title can be claimed by a single chart. A chart takes every remaining
+    title overlapping it by more than `iou_th`; failing that, the closest remaining title above or below it if that
+    title is near enough. The IoU and distance matrices are computed once for all chart/title pairs.
+
+    Returns the merged chart bounding boxes and a boolean mask of the charts that were matched with a title.
+    """
+    chart_bboxes = chart_bboxes.copy()
+    found_title = np.zeros(len(chart_bboxes), dtype=bool)
+
     if not len(title_bboxes):
-        return None
+        return chart_bboxes, found_title
 
-    dist_above = np.abs(title_bboxes[:, 3] - chart_bbox[1])
-    dist_below = np.abs(chart_bbox[3] - title_bboxes[:, 1])
+    ious = bb_iou_matrix(chart_bboxes, title_bboxes)
 
-    dist_left = np.abs(title_bboxes[:, 0] - chart_bbox[0])
+    dist_above = np.abs(title_bboxes[None, :, 3] - chart_bboxes[:, None, 1])
+    dist_below = np.abs(chart_bboxes[:, None, 3] - title_bboxes[None, :, 1])
+    dist_left = np.abs(title_bboxes[None, :, 0] - chart_bboxes[:, None, 0])
+    dists = np.minimum(dist_above, dist_below) + dist_left
 
-    ious = bb_iou_array(title_bboxes, chart_bbox)
+    available = np.ones(len(title_bboxes), dtype=bool)
+    for i in range(len(chart_bboxes)):
+        if not available.any():
+            break
 
-    matches = None
-    if np.max(ious) > iou_th:
-        matches = np.where(ious > iou_th)[0]
-    else:
-        dists = np.min([dist_above, dist_below], 0)
-        dists += dist_left
-        #         print(dists)
-        if np.min(dists) < 0.1:
-            matches = [np.argmin(dists)]
-
-    if matches is not None:
-        new_bbox = chart_bbox
-        for match in matches:
-            new_bbox = merge_boxes(new_bbox, title_bboxes[match])
-        title_bboxes = title_bboxes[[i for i in range(len(title_bboxes)) if i not in matches]]
-        return new_bbox, title_bboxes
+        if ious[i, available].max() > iou_th:
+            matches = available & (ious[i] > iou_th)
+        else:
+            closest = np.argmin(np.where(available, dists[i], np.inf))
+            if dists[i, closest] >= 0.1:
+                continue
+            matches = np.zeros_like(available)
+            matches[closest] = True
 
-    else:
-        return None
+        chart_bboxes[i, :2] = np.minimum(chart_bboxes[i, :2], title_bboxes[matches, :2].min(axis=0))
+        chart_bboxes[i, 2:] = np.maximum(chart_bboxes[i, 2:], title_bboxes[matches, 2:].max(axis=0))
+        available &= ~matches
+        found_title[i] = True
 
+    return chart_bboxes, found_title
 
-def bb_iou_array(boxes, new_box):
-    # bb interesection over union
-    xA = np.maximum(boxes[:, 0], new_box[0])
-    yA = np.maximum(boxes[:, 1], new_box[1])
-    xB = np.minimum(boxes[:, 2], new_box[2])
-    yB = np.minimum(boxes[:, 3], new_box[3])
 
-    interArea = np.maximum(xB - xA, 0) * np.maximum(yB - yA, 0)
+def bb_iou_matrix(boxes_a, boxes_b):
+    """
+    Pairwise intersection over union between two arrays of boxes in (x0, y0, x1, y1) format.
 
-    # compute the area of both the prediction and ground-truth rectangles
-    boxAArea = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
-    boxBArea = (new_box[2] - new_box[0]) * (new_box[3] - new_box[1])
+    Returns an array of shape (len(boxes_a), len(boxes_b)).
+    """
+    xA = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    yA = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    xB = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    yB = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
 
-    iou = interArea / (boxAArea + boxBArea - interArea)
+    interArea = np.maximum(xB - xA, 0) * np.maximum(yB - yA, 0)
 
-    return iou
+    boxAArea = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    boxBArea = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
 
+    iou = interArea / (boxBArea[None, :] + boxAArea[:, None] - interArea)
 
-def merge_boxes(b1, b2):
-    b = b1.copy()
-    b[0] = min(b1[0], b2[0])
-    b[1] = min(b1[1], b2[1])
-    b[2] = max(b1[2], b2[2])
-    b[3] = max(b1[3], b2[3])
-    return b
+    return iou
 
 
 def expand_boxes(boxes, r_x=1, r_y=1):
@@ -854,19 +980,14 @@ def get_weighted_box(boxes, conf_type="avg"):
         np array [8]: Merged box.
     """
     box = np.zeros(8, dtype=np.float32)
-    conf = 0
-    conf_list = []
-    w = 0
-    for b in boxes:
-        box[4:] += b[1] * b[4:]
-        conf += b[1]
-        conf_list.append(b[1])
-        w += b[2]
-
-    box[0] = merge_labels(np.array([b[0] for b in boxes]), np.array([b[1] for b in boxes]))
-
-    box[1] = np.max(conf_list) if conf_type == "max" else np.mean(conf_list)
-    box[2] = w
+    confs = boxes[:, 1]
+
+    # Confidence-weighted average of the coordinates
+    box[4:] = confs @ boxes[:, 4:] / confs.sum()
+
+    box[0] = merge_labels(boxes[:, 0], confs)
+
+    box[1] = confs.max() if conf_type == "max" else confs.mean()
+    box[2] = boxes[:, 2].sum()
     box[3] = -1  # model index field is retained for consistency but is not used.
-    box[4:] /= conf
     return box
@@ -59,6 +59,8 @@ class PipelineCreationSchema(BaseModel):
         "YOLOX_HTTP_ENDPOINT", "https://ai.api.nvidia.com/v1/cv/nvidia/nv-yolox-page-elements-v1"
     )
     yolox_infer_protocol: str = "http"
+    yolox_input_dtype: str = "float32"
+    yolox_use_gpu: str = "false"
 
     model_config = ConfigDict(extra="forbid")
 
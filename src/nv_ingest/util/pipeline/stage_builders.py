@@ -97,6 +97,16 @@ def get_table_detection_service(env_var_prefix):
     return grpc_endpoint, http_endpoint, auth_token, infer_protocol
 
 
+def get_yolox_options():
+    use_gpu = os.environ.get("YOLOX_USE_GPU", "false")
+    input_dtype = os.environ.get("YOLOX_INPUT_DTYPE", "float32")
+
+    logger.info(f"YOLOX_USE_GPU: {use_gpu}")
+    logger.info(f"YOLOX_INPUT_DTYPE: {input_dtype}")
+
+    return {"yolox_use_gpu": use_gpu, "yolox_input_dtype": input_dtype}
+
+
 def get_default_cpu_count():
     default_cpu_count = os.environ.get("NV_INGEST_MAX_UTIL", int(max(1, math.floor(len(os.sched_getaffinity(0))))))
 
@@ -186,6 +196,7 @@ def add_pdf_extractor_stage(pipe, morpheus_pipeline_config, ingest_config, defau
             "pdfium_config": {
                 "yolox_endpoints": (yolox_grpc, yolox_http),
                 "yolox_infer_protocol": yolox_protocol,
+                **get_yolox_options(),
                 "auth_token": yolox_auth,  # All auth tokens are the same for the moment
             }
         },
@@ -262,6 +273,7 @@ def add_image_extractor_stage(pipe, morpheus_pipeline_config, ingest_config, def
             "image_extraction_config": {
                 "yolox_endpoints": (yolox_grpc, yolox_http),
                 "yolox_infer_protocol": yolox_protocol,
+                **get_yolox_options(),
                 "auth_token": yolox_auth,
                 # All auth tokens are the same for the moment
             }
@@ -287,6 +299,7 @@ def add_docx_extractor_stage(pipe, morpheus_pipeline_config, ingest_config, defa
             "docx_extraction_config": {
                 "yolox_endpoints": (yolox_grpc, yolox_http),
                 "yolox_infer_protocol": yolox_protocol,
+                **get_yolox_options(),
                 "auth_token": yolox_auth,
             }
         },
@@ -311,6 +324,7 @@ def add_pptx_extractor_stage(pipe, morpheus_pipeline_config, ingest_config, defa
             "pptx_extraction_config": {
                 "yolox_endpoints": (yolox_grpc, yolox_http),
                 "yolox_infer_protocol": yolox_protocol,
+                **get_yolox_options(),
                 "auth_token": yolox_auth,
             }
         },
@@ -51,6 +51,26 @@ def test_image_config_schema_missing_infer_protocol():
     assert config.yolox_infer_protocol == "grpc"
 
 
+def test_image_config_schema_yolox_use_gpu():
+    # GPU preprocessing is opt-in; string values coming from environment variables are coerced
+    config = ImageConfigSchema(yolox_endpoints=("grpc_service_url", None))
+    assert config.yolox_use_gpu is False
+
+    config = ImageConfigSchema(yolox_endpoints=("grpc_service_url", None), yolox_use_gpu="true")
+    assert config.yolox_use_gpu is True
+
+
+def test_image_config_schema_yolox_input_dtype():
+    config = ImageConfigSchema(yolox_endpoints=("grpc_service_url", None))
+    assert config.yolox_input_dtype == "float32"
+
+    config = ImageConfigSchema(yolox_endpoints=("grpc_service_url", None), yolox_input_dtype="float16")
+    assert config.yolox_input_dtype == "float16"
+
+    with pytest.raises(ValidationError):
+        ImageConfigSchema(yolox_endpoints=("grpc_service_url", None), yolox_input_dtype="int8")
+
+
 def test_image_config_schema_extra_field():
     # Test extra fields raise a validation error
     with pytest.raises(ValidationError):
@@ -1,12 +1,24 @@
 import base64
+import multiprocessing
 import random
+import warnings
 from io import BytesIO
 
 import numpy as np
 import pytest
+import torch
 from PIL import Image
 
+import nv_ingest.util.nim.yolox as yolox
+
 from nv_ingest.util.nim.yolox import YoloxPageElementsModelInterface
+from nv_ingest.util.nim.yolox import match_charts_with_titles
+from nv_ingest.util.nim.yolox import postprocess_model_prediction
+from nv_ingest.util.nim.yolox import postprocess_results
+from nv_ingest.util.nim.yolox import resize_image
+from nv_ingest.util.nim.yolox import resize_images_torch
+from nv_ingest.util.nim.yolox import union_find_clusters
+from nv_ingest.util.nim.yolox import weighted_boxes_fusion
 
 
 @pytest.fixture
@@ -70,9 +82,10 @@ def test_prepare_data_for_inference_valid(model_interface):
     input_data = {"images": images}
     result = model_interface.prepare_data_for_inference(input_data)
     assert "original_image_shapes" in result
-    assert len(result["original_image_shapes"]) == len(images)
+    assert isinstance(result["original_image_shapes"], np.ndarray)
+    assert result["original_image_shapes"].shape == (len(images), 2)
     for original_shape, image in zip(result["original_image_shapes"], images):
-        assert original_shape[:2] == image.shape[:2]
+        assert tuple(original_shape) == image.shape[:2]
 
 
 def test_prepare_data_for_inference_missing_images(model_interface):
@@ -106,6 +119,22 @@ def test_format_input_grpc(model_interface):
     assert nparray.shape[1:] == (3, 1024, 1024)
 
 
+def test_format_input_grpc_gpu_resize_is_opt_in(monkeypatch):
+    monkeypatch.setattr("torch.cuda.is_available", lambda: True)
+
+    def fail_resize_images_torch(*args, **kwargs):
+        raise AssertionError("GPU resizing must not be used unless enabled")
+
+    monkeypatch.setattr("nv_ingest.util.nim.yolox.resize_images_torch", fail_resize_images_torch)
+
+    model_interface = YoloxPageElementsModelInterface()
+    prepared_data = model_interface.prepare_data_for_inference({"images": [create_test_image()]})
+    batches = model_interface.format_input(prepared_data, "grpc", max_batch_size=1)
+
+    assert not model_interface.use_gpu
+    assert batches[0].shape == (1, 3, 1024, 1024)
+
+
 def test_format_input_http(model_interface):
     images = [create_test_image(), create_test_image()]
     input_data = {"images": images}
@@ -121,6 +150,52 @@ def test_format_input_http(model_interface):
         assert content["url"].startswith("data:image/png;base64,")
 
 
+def test_format_input_http_png_round_trip(model_interface):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(64, 96, 3), dtype=np.uint8)
+
+    prepared_data = model_interface.prepare_data_for_inference({"images": [image / 255.0]})
+    content = model_interface.format_input(prepared_data, "http", max_batch_size=1)[0]["input"][0]
+
+    encoded = content["url"].split(",", 1)[1]
+    decoded = np.array(Image.open(BytesIO(base64.b64decode(encoded))))
+    np.testing.assert_array_equal(decoded, image)
+
+
+def test_format_input_http_encoding_failure(model_interface, monkeypatch):
+    monkeypatch.setattr("cv2.imencode", lambda *args, **kwargs: (False, np.empty(0, dtype=np.uint8)))
+
+    prepared_data = model_interface.prepare_data_for_inference({"images": [create_test_image()]})
+    with pytest.raises(ValueError, match="Failed to encode image"):
+        model_interface.format_input(prepared_data, "http", max_batch_size=1)
+
+
+def _format_http_in_child(queue):
+    model_interface = YoloxPageElementsModelInterface()
+    prepared_data = model_interface.prepare_data_for_inference({"images": [create_test_image(), create_test_image()]})
+    batches = model_interface.format_input(prepared_data, "http", max_batch_size=2)
+    queue.put(len(batches[0]["input"]))
+
+
+def test_format_input_http_reuses_encode_executor(model_interface):
+    images = [create_test_image(), create_test_image()]
+    prepared_data = model_interface.prepare_data_for_inference({"images": images})
+
+    model_interface.format_input(prepared_data, "http", max_batch_size=2)
+    executor = yolox._encode_executor
+    model_interface.format_input(prepared_data, "http", max_batch_size=2)
+    assert executor is not None and yolox._encode_executor is executor
+
+    # A forked child must not inherit the parent's (thread-less) executor
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_format_http_in_child, args=(queue,))
+    process.start()
+    process.join(timeout=60)
+    assert process.exitcode == 0
+    assert queue.get(timeout=1) == 2
+
+
 def test_format_input_invalid_protocol(model_interface):
     images = [create_test_image()]
     input_data = {"images": images}
@@ -236,3 +311,161 @@ def test_process_inference_results_http(model_interface):
                 assert bbox[4] >= 0.6
         if "title" in result:
             assert isinstance(result["title"], list)
+
+
+def test_postprocess_model_prediction_box_corners():
+    # [cx, cy, w, h, obj_conf, class_0, class_1, class_2]
+    prediction = np.array(
+        [
+            [[100.0, 100.0, 40.0, 20.0, 0.9, 0.1, 0.8, 0.1], [500.0, 500.0, 10.0, 10.0, 0.1, 0.1, 0.1, 0.1]],
+            [[300.0, 200.0, 20.0, 60.0, 0.9, 0.9, 0.05, 0.05], [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]],
+        ],
+        dtype=np.float32,
+    )
+    output = postprocess_model_prediction(prediction, num_classes=3, conf_thre=0.5, nms_thre=0.45)
+
+    assert len(output) == 2
+    assert len(output[0]) == 1 and len(output[1]) == 1
+    assert output[0][0].tolist() == pytest.approx([80.0, 90.0, 120.0, 110.0, 0.9, 0.8, 1.0])
+    assert output[1][0].tolist() == pytest.approx([290.0, 170.0, 310.0, 230.0, 0.9, 0.9, 0.0])
+
+
+def test_postprocess_model_prediction_read_only_input():
+    prediction = np.zeros((1, 2, 8), dtype=np.float32)
+    prediction[0, 0] = [100.0, 100.0, 40.0, 20.0, 0.9, 0.1, 0.8, 0.1]
+    prediction.setflags(write=False)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        output = postprocess_model_prediction(prediction, num_classes=3, conf_thre=0.5, nms_thre=0.45)
+
+    assert output[0][0].tolist() == pytest.approx([80.0, 90.0, 120.0, 110.0, 0.9, 0.8, 1.0])
+
+
+def test_postprocess_model_prediction_defaults_to_cpu(monkeypatch):
+    monkeypatch.setattr("torch.cuda.is_available", lambda: True)
+    prediction = np.zeros((1, 2, 8), dtype=np.float32)
+    prediction[0, 0] = [100.0, 100.0, 40.0, 20.0, 0.9, 0.1, 0.8, 0.1]
+
+    output = postprocess_model_prediction(prediction, num_classes=3, conf_thre=0.5, nms_thre=0.45)
+
+    assert output[0].device.type == "cpu"
+    assert output[0][0].tolist() == pytest.approx([80.0, 90.0, 120.0, 110.0, 0.9, 0.8, 1.0])
+
+
+def test_postprocess_model_prediction_no_detections():
+    prediction = np.zeros((2, 10, 8), dtype=np.float32)
+    output = postprocess_model_prediction(prediction, num_classes=3, conf_thre=0.5, nms_thre=0.45)
+    assert output == [None, None]
+
+
+def test_postprocess_results_non_square_preproc_size(monkeypatch):
+    monkeypatch.setattr("nv_ingest.util.nim.yolox.YOLOX_IMAGE_PREPROC_HEIGHT", 512)
+    monkeypatch.setattr("nv_ingest.util.nim.yolox.YOLOX_IMAGE_PREPROC_WIDTH", 1024)
+
+    # A 200x100 (height x width) image is resized by min(512 / 200, 1024 / 100) = 2.56 to 512x256
+    result = torch.tensor([[0.0, 0.0, 256.0, 512.0, 0.9, 1.0, 0.0]])
+    output = postprocess_results([result], np.array([[200, 100]]))
+
+    assert output[0]["table"] == [[0.0, 0.0, 1.0, 1.0, 0.9]]
+
+
+def test_resize_image_letterbox():
+    image = create_test_image(width=800, height=600, color=(10, 20, 30))
+    resized = resize_image(image, (1024, 1024))
+
+    assert resized.shape == (1024, 1024, 3)
+    assert resized.dtype == np.uint8
+    # The image is scaled to 1024x768 and padded at the bottom with 114
+    assert (resized[:768] == (10, 20, 30)).all()
+    assert (resized[768:] == 114).all()
+
+
+def test_resize_images_torch_matches_resize_image():
+    images = [create_test_image(), create_test_image(width=640, height=960, color=(0, 128, 255))]
+    batch = resize_images_torch(images, (1024, 1024), device="cpu")
+
+    assert batch.dtype == np.float32
+    assert batch.shape == (2, 3, 1024, 1024)
+    for resized, image in zip(batch, images):
+        expected = resize_image(image, (1024, 1024)).transpose(2, 0, 1)
+        assert np.abs(resized - expected).max() <= 1
+
+
+def test_weighted_boxes_fusion_merges_overlapping_boxes():
+    boxes = np.array(
+        [
+            [0.10, 0.10, 0.30, 0.30],
+            [0.12, 0.12, 0.32, 0.32],
+            [0.28, 0.28, 0.50, 0.50],
+            [0.70, 0.70, 0.90, 0.90],
+        ]
+    )
+    scores = np.array([0.9, 0.8, 0.7, 0.6])
+    labels = np.array([1, 1, 1, 1])
+
+    merged_boxes, merged_scores, merged_labels = weighted_boxes_fusion(
+        boxes[:, None],
+        scores[:, None],
+        labels[:, None],
+        iou_thr=0.01,
+        merge_type="biggest",
+        conf_type="max",
+    )
+
+    # The first three boxes are chained by overlaps and fused into one; the last one stays on its own
+    assert merged_boxes.tolist() == [pytest.approx([0.10, 0.10, 0.50, 0.50]), pytest.approx([0.70, 0.70, 0.90, 0.90])]
+    assert merged_scores.tolist() == pytest.approx([0.9, 0.6])
+    assert merged_labels.tolist() == [1, 1]
+
+
+def test_match_charts_with_titles():
+    chart_bboxes = np.array([[0.1, 0.2, 0.5, 0.6], [0.6, 0.6, 0.9, 0.9]])
+    # The first title sits right above the first chart, the second one is far away from both charts
+    title_bboxes = np.array([[0.12, 0.15, 0.4, 0.19], [0.0, 0.95, 0.05, 0.99]])
+
+    merged_bboxes, found_title = match_charts_with_titles(chart_bboxes, title_bboxes, iou_th=0.01)
+
+    assert found_title.tolist() == [True, False]
+    assert merged_bboxes.tolist() == [pytest.approx([0.1, 0.15, 0.5, 0.6]), pytest.approx([0.6, 0.6, 0.9, 0.9])]
+    # The input boxes are left untouched
+    assert chart_bboxes[0].tolist() == [0.1, 0.2, 0.5, 0.6]
+
+
+def test_format_input_grpc_input_dtype():
+    model_interface = YoloxPageElementsModelInterface(input_dtype=np.float16)
+    images = [create_test_image(), create_test_image()]
+    prepared_data = model_interface.prepare_data_for_inference({"images": images})
+    formatted_input = model_interface.format_input(prepared_data, "grpc", max_batch_size=2)
+
+    assert formatted_input[0].dtype == np.float16
+    assert formatted_input[0].shape == (2, 3, 1024, 1024)
+
+
+def test_format_input_grpc_reuses_input_buffer(model_interface):
+    images = [create_test_image(), create_test_image(), create_test_image()]
+    prepared_data = model_interface.prepare_data_for_inference({"images": images})
+
+    first_batches = model_interface.format_input(prepared_data, "grpc", max_batch_size=2)
+    assert [batch.shape[0] for batch in first_batches] == [2, 1]
+    # Batches of a single call never overlap
+    assert not np.shares_memory(first_batches[0], first_batches[1])
+
+    second_batches = model_interface.format_input(prepared_data, "grpc", max_batch_size=2)
+    assert np.shares_memory(first_batches[0], second_batches[0])
+
+
+def test_resize_images_torch_out():
+    images = [create_test_image(), create_test_image(width=640, height=960)]
+    out = np.empty((2, 3, 1024, 1024), dtype=np.float16)
+
+    result = resize_images_torch(images, (1024, 1024), device="cpu", out=out)
+
+    assert result is out
+    np.testing.assert_array_equal(out, resize_images_torch(images, (1024, 1024), device="cpu", dtype=np.float16))
+
+
+def test_union_find_clusters():
+    cluster_ids = union_find_clusters(6, np.array([4, 1, 5, 2]), np.array([1, 4, 3, 5]))
+
+    assert cluster_ids.tolist() == [0, 1, 2, 2, 1, 2]